@@ -1,25 +1,33 @@
 """
-Script de extração de registros de ponto a partir de PDFs e exportação para Excel.
+Script de extração de registros de ponto a partir de PDFs e exportação para CSV/Excel.
 
 O script permite extrair tabelas de PDFs (relatórios de ponto) usando:
 1️⃣ Docling — método principal (mais preciso para PDFs estruturados)
-2️⃣ PyMuPDF (fitz) — método alternativo via texto + regex
+2️⃣ PyMuPDF (fitz) — método alternativo via colunas do cabeçalho (regex se não houver cabeçalho)
 
 """
 
+import argparse
+import hashlib
+import importlib.metadata
+import importlib.util
 import os
+import pathlib
+import pickle
 import re
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 
 # ----------------------------------------------------------------------
 # TENTATIVA DE IMPORTAÇÃO DAS BIBLIOTECAS
 # ----------------------------------------------------------------------
+# Docling é pesado: aqui só verificamos se está instalado, e o import de fato
+# acontece em carregar_tabelas_docling. Assim os processos do fallback PyMuPDF
+# (que reimportam este módulo no modo "spawn") não pagam esse custo.
 try:
-    from docling.document import Document
-    DOCLING_AVAILABLE = True
+    DOCLING_AVAILABLE = importlib.util.find_spec("docling") is not None
 except Exception:
-    Document = None
     DOCLING_AVAILABLE = False
 
 try:
@@ -29,6 +37,13 @@ except Exception:
     fitz = None
     PYMUPDF_AVAILABLE = False
 
+try:
+    import openpyxl
+    OPENPYXL_AVAILABLE = True
+except Exception:
+    openpyxl = None
+    OPENPYXL_AVAILABLE = False
+
 
 # ----------------------------------------------------------------------
 # CONFIGURAÇÕES DO USUÁRIO
@@ -37,9 +52,15 @@ except Exception:
 # 🔧 Informe o nome do seu arquivo PDF (de entrada)
 NOME_ARQUIVO_PDF = "entrada.pdf"
 
-# 🔧 Informe o nome do arquivo Excel (de saída)
+# 🔧 Informe o nome do arquivo CSV (saída padrão)
+NOME_ARQUIVO_CSV = "saida.csv"
+
+# 🔧 Informe o nome do arquivo Excel (gerado apenas com a opção --excel)
 NOME_ARQUIVO_EXCEL = "saida.xlsx"
 
+# 🔧 Pasta onde as tabelas já lidas pelo Docling ficam guardadas (por checksum do PDF)
+PASTA_CACHE_DOCLING = ".docling_cache"
+
 # 🔧 Defina aqui os nomes das colunas conforme aparecem no SEU PDF
 #    Por exemplo: ["Nome", "Data", "Entrada 1", "Saída 1", "Entrada 2", "Saída 2", "Total"]
 #    A quantidade deve corresponder à tabela que aparece no PDF.
@@ -55,10 +76,123 @@ COLUNAS_NOMES = [
 
 NUM_COLUNAS_ESPERADO = len(COLUNAS_NOMES)
 
+# Distância vertical máxima (em pontos) entre os centros de palavras da mesma linha no PDF
+TOLERANCIA_LINHA_PT = 3
+
+# A partir de quantas páginas a extração PyMuPDF é dividida entre processos
+MIN_PAGINAS_PARALELO = 20
+
+# Quantas páginas iniciais são examinadas à procura da linha de cabeçalho
+MAX_PAGINAS_CABECALHO = 3
+
+
+# ----------------------------------------------------------------------
+# EXPRESSÕES REGULARES (pré-compiladas uma única vez)
+# ----------------------------------------------------------------------
+_RE_NAME_PUNCT = re.compile(r'[\n;:]')
+_RE_NAME_KEEPCHARS = re.compile(r'[^\w\sÁÀÃÂÉÈÊÍÌÓÒÕÔÚÙÇ\-]')
+_RE_MULTI_WS = re.compile(r'\s{2,}')
+_RE_DATE = re.compile(r'\d{2}/\d{2}/\d{4}')
+_RE_TIME = re.compile(r'\d{2}:\d{2}:\d{2}')
+_RE_EMPTY_CELL = re.compile(r'^(?:\s*|nan|None)$')
+
+# Registro completo do fallback PyMuPDF numa única passada:
+# nome (opcional), data e até cinco horários na sequência.
+# Ancorado no início de linha e com separadores [ \t] para que cada
+# registro fique restrito à própria linha.
+_RE_RECORD = re.compile(
+    rf'^(?:([^\n]{{0,120}}?)[ \t]+)?({_RE_DATE.pattern})'
+    + rf'(?:[ \t]+({_RE_TIME.pattern}))?' * 5,
+    re.MULTILINE
+)
+
+# Palavras-chave (em minúsculas) de cabeçalhos e rodapés
+_KEYWORDS = [
+    "nome", "data", "entr", "said", "tarde", "manha", "instituição",
+    "página", "emissão", "estado de mato grosso", "relação de registro"
+]
+
+# Cabeçalhos que aparecem como o conteúdo inteiro da célula. Só entram os que
+# as palavras-chave já removeriam ("Total" sozinho pode ser linha de dados).
+_EXACT_HEADERS = frozenset(
+    h for h in (c.casefold() for c in [*COLUNAS_NOMES, "TotalNome"])
+    if any(kw in h for kw in _KEYWORDS)
+)
+
+
+# ----------------------------------------------------------------------
+# FUNÇÃO: LIMPEZA DE NOMES
+# ----------------------------------------------------------------------
+def limpar_nome(serie):
+    """Limpa a coluna de nomes inteira, removendo ruídos e caracteres extras."""
+    # O mesmo nome se repete em todos os dias do mês: limpa apenas os valores
+    # distintos e depois espalha o resultado pelas linhas.
+    codigos, unicos = pd.factorize(serie)
+    texto = pd.Series(unicos, dtype=object).astype(str)
+    # Células vazias viram '' direto, sem passar pelas regex
+    preenchido = texto.str.strip() != ''
+
+    limpos = pd.Series('', index=texto.index, dtype=object)
+    limpos[preenchido] = (
+        texto[preenchido]
+        .str.replace(_RE_NAME_PUNCT, ' ', regex=True)
+        .str.replace(_RE_NAME_KEEPCHARS, ' ', regex=True)
+        .str.replace(_RE_MULTI_WS, ' ', regex=True)
+        .str.strip()
+    )
+
+    # NaN recebe o código -1 no factorize, que aponta para o '' acrescentado no fim
+    valores = np.append(limpos.to_numpy(dtype=object), '')
+    return pd.Series(valores[codigos], index=serie.index, dtype=object)
+
 
 # ----------------------------------------------------------------------
 # FUNÇÃO: EXTRAÇÃO COM DOCLING
 # ----------------------------------------------------------------------
+def carregar_tabelas_docling(pdf_path):
+    """Converte as tabelas do PDF com Docling, reaproveitando o cache em disco se houver."""
+    sha1 = hashlib.sha1()
+    with open(pdf_path, "rb") as f:
+        for bloco in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(bloco)
+    # A versão do Docling entra na chave: atualizar a biblioteca refaz a leitura
+    try:
+        versao = importlib.metadata.version("docling")
+    except Exception:
+        versao = "desconhecida"
+    cache = pathlib.Path(PASTA_CACHE_DOCLING) / f"{sha1.hexdigest()}-{versao}.pkl"
+
+    if cache.exists():
+        try:
+            return pickle.loads(cache.read_bytes())
+        except Exception as e:
+            print(f"Cache do Docling inválido, reprocessando: {e}")
+
+    from docling.document import Document
+
+    doc = Document.from_file(pdf_path)
+    tabelas = []
+    completo = True
+    for i, tabela in enumerate(getattr(doc, "tables", None) or []):
+        try:
+            tabelas.append(tabela.to_pandas(fill_na=True))
+        except Exception as e:
+            print(f"Falha ao converter tabela {i+1}: {e}")
+            completo = False
+
+    # Só guarda leituras completas, para não servir tabelas faltando nas próximas execuções
+    if not completo:
+        return tabelas
+
+    # O cache é só um atalho: falhar ao gravá-lo não pode descartar a extração
+    try:
+        cache.parent.mkdir(exist_ok=True)
+        cache.write_bytes(pickle.dumps(tabelas))
+    except Exception as e:
+        print(f"Não foi possível gravar o cache do Docling: {e}")
+    return tabelas
+
+
 def extrair_com_docling(pdf_path):
     """Tenta extrair tabelas usando a biblioteca Docling."""
     if not DOCLING_AVAILABLE:
@@ -71,61 +205,59 @@ def extrair_com_docling(pdf_path):
 
     try:
         print("🔹 Extraindo tabelas com Docling...")
-        doc = Document.from_file(pdf_path)
+        tabelas = carregar_tabelas_docling(pdf_path)
 
-        if not getattr(doc, "tables", None):
+        if not tabelas:
             print("Docling não detectou tabelas.")
             return None
 
-        df_final = pd.DataFrame()
-
-        def row_contains_keywords(row):
-            """Remove cabeçalhos e rodapés com palavras-chave comuns."""
-            keywords = [
-                "nome", "data", "entr", "said", "tarde", "manha", "instituição",
-                "página", "emissão", "estado de mato grosso", "relação de registro"
-            ]
-            try:
-                return any(any(k in str(item).lower() for k in keywords) for item in row)
-            except Exception:
-                return True
-
-        for i, tabela in enumerate(doc.tables):
-            try:
-                df_tabela = tabela.to_pandas(fill_na=True)
-            except Exception as e:
-                print(f"Falha ao converter tabela {i+1}: {e}")
-                continue
+        partes = []
+        estrutura_verificada = False
 
+        for df_tabela in tabelas:
             if df_tabela.empty:
                 continue
 
-            # Garante o número correto de colunas
-            if len(df_tabela.columns) > NUM_COLUNAS_ESPERADO:
-                df_tabela = df_tabela.iloc[:, :NUM_COLUNAS_ESPERADO]
-            elif len(df_tabela.columns) < NUM_COLUNAS_ESPERADO:
-                for _ in range(NUM_COLUNAS_ESPERADO - len(df_tabela.columns)):
-                    df_tabela[len(df_tabela.columns)] = np.nan
-
-            df_tabela.columns = range(NUM_COLUNAS_ESPERADO)
-            df_tabela = df_tabela[~df_tabela.apply(row_contains_keywords, axis=1)]
-
-            df_final = pd.concat([df_final, df_tabela], ignore_index=True)
+            # Garante o número correto de colunas (corta o excesso e completa com NaN)
+            df_tabela = df_tabela.iloc[:, :NUM_COLUNAS_ESPERADO]
+            df_tabela.columns = range(len(df_tabela.columns))
+            df_tabela = df_tabela.reindex(columns=range(NUM_COLUNAS_ESPERADO))
+            df_tabela = df_tabela.dropna(how='all')
+
+            # Remove cabeçalhos e rodapés com palavras-chave comuns, varrendo a
+            # tabela inteira como matriz de strings do numpy
+            celulas = np.char.lower(np.char.strip(df_tabela.astype(str).to_numpy(dtype=str)))
+            mask = np.isin(celulas, list(_EXACT_HEADERS)).any(axis=1)
+            # Palavras-chave só são procuradas nas linhas que não eram cabeçalho exato
+            pendentes = ~mask
+            restantes = celulas[pendentes]
+            achou = np.zeros(len(restantes), dtype=bool)
+            for kw in _KEYWORDS:
+                achou |= (np.char.find(restantes, kw) != -1).any(axis=1)
+            mask[pendentes] = achou
+            df_tabela = df_tabela[~mask]
+
+            # Teste estrutural barato na primeira tabela com dados: sem nenhuma
+            # data na segunda coluna, o Docling leu errado e o fallback assume.
+            if not estrutura_verificada and not df_tabela.empty:
+                if not df_tabela[1].astype(str).str.match(_RE_DATE).any():
+                    print("Docling não reconheceu a coluna de datas.")
+                    return None
+                estrutura_verificada = True
+
+            partes.append(df_tabela)
+
+        # Concatena uma única vez ao final (evita cópias repetidas a cada tabela)
+        df_final = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame()
 
         if df_final.empty:
             print("Docling produziu DataFrame vazio.")
             return None
 
         df_final.columns = COLUNAS_NOMES
-        df_final = df_final.replace(r'^\s*$', '', regex=True).replace(['nan', 'None'], '', regex=True)
-
-        def limpar_nome(texto):
-            """Limpa o campo de nome, removendo ruídos e caracteres extras."""
-            texto = re.sub(r'[\n;:]', ' ', str(texto))
-            texto = re.sub(r'[^\w\sÁÀÃÂÉÈÊÍÌÓÒÕÔÚÙÇ\-]', ' ', texto)
-            return re.sub(r'\s{2,}', ' ', texto).strip()
+        df_final = df_final.replace(_RE_EMPTY_CELL, '', regex=True)
 
-        df_final[COLUNAS_NOMES[0]] = df_final[COLUNAS_NOMES[0]].apply(limpar_nome)
+        df_final[COLUNAS_NOMES[0]] = limpar_nome(df_final[COLUNAS_NOMES[0]])
 
         print("✅ Extração com Docling concluída.")
         return df_final
@@ -138,8 +270,99 @@ def extrair_com_docling(pdf_path):
 # ----------------------------------------------------------------------
 # FUNÇÃO: EXTRAÇÃO COM PyMuPDF (fallback)
 # ----------------------------------------------------------------------
+def montar_linhas_pagina(page):
+    """Agrupa as palavras da página em linhas, como listas de (x central, palavra)."""
+    # Agrupa pelo centro vertical: palavras com fonte maior (top mais alto)
+    # continuam na mesma linha das vizinhas
+    palavras = sorted(
+        ((y0 + y1) / 2, (x0 + x1) / 2, palavra)
+        for x0, y0, x1, y1, palavra, *_ in page.get_text("words")
+    )
+
+    linhas = []
+    linha_atual = []
+    y_atual = None
+    for y_centro, x_centro, palavra in palavras:
+        if y_atual is None or y_centro - y_atual > TOLERANCIA_LINHA_PT:
+            if linha_atual:
+                linhas.append(sorted(linha_atual))
+            linha_atual = []
+            y_atual = y_centro
+        linha_atual.append((x_centro, palavra))
+    if linha_atual:
+        linhas.append(sorted(linha_atual))
+    return linhas
+
+
+def detectar_colunas(linhas):
+    """Procura a linha de cabeçalho e devolve o x central de cada coluna de COLUNAS_NOMES."""
+    alvos = [c.casefold() for c in COLUNAS_NOMES]
+    for linha in linhas:
+        posicoes = {p.casefold(): x for x, p in linha}
+        if all(a in posicoes for a in alvos):
+            return [posicoes[a] for a in alvos]
+    return None
+
+
+def extrair_registros_colunas(linhas, colunas):
+    """Distribui as palavras de cada linha na coluna de cabeçalho mais próxima."""
+    centros = np.asarray(colunas)
+    registros = []
+    for linha in linhas:
+        celulas = [[] for _ in colunas]
+        for x, palavra in linha:
+            celulas[int(np.abs(centros - x).argmin())].append(palavra)
+        # Nomes longos podem invadir a coluna Data: o que vem antes da data é nome
+        datas = [i for i, p in enumerate(celulas[1]) if _RE_DATE.fullmatch(p)]
+        if not datas:
+            continue
+        nome = " ".join(celulas[0] + celulas[1][:datas[0]])
+        data = celulas[1][datas[0]]
+        horarios = [" ".join(c) for c in celulas[2:]]
+
+        nome = _RE_NAME_KEEPCHARS.sub(' ', nome)
+        nome = _RE_MULTI_WS.sub(' ', nome).strip()
+        # Célula vazia continua vazia: os horários seguintes não mudam de coluna
+        horarios = [h if _RE_TIME.fullmatch(h) else '' for h in horarios]
+
+        registros.append((nome, data, *horarios))
+    return registros
+
+
+def extrair_registros_texto(texto):
+    """Aplica a regex de registro às linhas de uma página."""
+    registros = []
+    for m in _RE_RECORD.finditer(texto):
+        nome_cand, date_str, *times = m.groups()
+        nome_cand = _RE_NAME_KEEPCHARS.sub(' ', nome_cand or '')
+        nome_cand = _RE_MULTI_WS.sub(' ', nome_cand).strip()
+        times = [t or '' for t in times]
+
+        registros.append((nome_cand, date_str, *times))
+    return registros
+
+
+def extrair_registros_pagina(page, colunas):
+    """Extrai os registros de uma página, pelas colunas do cabeçalho ou pela regex."""
+    linhas = montar_linhas_pagina(page)
+    if colunas is not None:
+        return extrair_registros_colunas(linhas, colunas)
+    # Sem cabeçalho no documento: volta a juntar o texto e separar pela regex
+    texto = "\n".join(" ".join(p for _, p in linha) for linha in linhas)
+    return extrair_registros_texto(texto)
+
+
+def extrair_registros_intervalo(pdf_path, inicio, fim, colunas):
+    """Abre o PDF e extrai os registros das páginas [inicio, fim), uma página por vez."""
+    registros = []
+    with fitz.open(pdf_path) as doc:
+        for i in range(inicio, fim):
+            registros.extend(extrair_registros_pagina(doc[i], colunas))
+    return registros
+
+
 def extrair_com_pymupdf(pdf_path):
-    """Tenta extrair texto puro e reconstruir tabela com expressões regulares."""
+    """Reconstrói a tabela pela posição das palavras (regex só sem cabeçalho)."""
     if not PYMUPDF_AVAILABLE:
         print("PyMuPDF não disponível. Instale com 'pip install pymupdf'.")
         return None
@@ -150,42 +373,46 @@ def extrair_com_pymupdf(pdf_path):
 
     try:
         print("🔹 Extraindo texto com PyMuPDF (modo fallback)...")
-        doc = fitz.open(pdf_path)
-        textos = [page.get_text("text") for page in doc]
-        doc.close()
-
-        text = "\n".join(textos)
-        text = text.replace("\t", " ")
-        text = re.sub(r'\n{2,}', '\n', text)
-
-        registros = []
-        for m in re.finditer(r'\d{2}/\d{2}/\d{4}', text):
-            date_str = m.group(0)
-            snippet = text[max(0, m.start() - 400):m.end()]
-            times = re.findall(r'\d{2}:\d{2}:\d{2}', snippet)[-5:]
-            while len(times) < 5:
-                times.append('')
-
-            first_time_match = re.search(r'\d{2}:\d{2}:\d{2}', snippet)
-            nome_cand = snippet[:first_time_match.start()].strip() if first_time_match else snippet.strip()
-            nome_cand = re.sub(r'[^\w\sÁÀÃÂÉÈÊÍÌÓÒÕÔÚÙÇ\-]', ' ', nome_cand)
-            nome_cand = re.sub(r'\s{2,}', ' ', nome_cand).strip()
-
-            registros.append({
-                COLUNAS_NOMES[0]: nome_cand,
-                COLUNAS_NOMES[1]: date_str,
-                COLUNAS_NOMES[2]: times[0],
-                COLUNAS_NOMES[3]: times[1],
-                COLUNAS_NOMES[4]: times[2],
-                COLUNAS_NOMES[5]: times[3],
-                COLUNAS_NOMES[6]: times[4]
-            })
+        # As colunas vêm do primeiro cabeçalho do documento e valem para todas as
+        # páginas. Só as primeiras páginas são lidas: sem cabeçalho ali, não vale
+        # uma passada serial extra pelo documento inteiro.
+        colunas = None
+        with fitz.open(pdf_path) as doc:
+            total_paginas = doc.page_count
+            for i in range(min(MAX_PAGINAS_CABECALHO, total_paginas)):
+                colunas = detectar_colunas(montar_linhas_pagina(doc[i]))
+                if colunas is not None:
+                    break
+        if colunas is None:
+            print("Cabeçalho não encontrado; separando os campos por regex.")
+
+        # PyMuPDF não é thread-safe: cada processo abre o próprio documento
+        n_workers = min(os.cpu_count() or 1, total_paginas)
+        if total_paginas < MIN_PAGINAS_PARALELO or n_workers < 2:
+            registros = extrair_registros_intervalo(pdf_path, 0, total_paginas, colunas)
+        else:
+            passo = -(-total_paginas // n_workers)
+            inicios = range(0, total_paginas, passo)
+            try:
+                with ProcessPoolExecutor(max_workers=n_workers) as ex:
+                    blocos = ex.map(
+                        extrair_registros_intervalo,
+                        [pdf_path] * len(inicios),
+                        inicios,
+                        [min(i + passo, total_paginas) for i in inicios],
+                        [colunas] * len(inicios),
+                    )
+                    registros = [r for bloco in blocos for r in bloco]
+            except Exception as e:
+                # Sem multiprocessamento no ambiente (ou processo morto): segue em série
+                print(f"Processos paralelos indisponíveis, extraindo em série: {e}")
+                registros = extrair_registros_intervalo(pdf_path, 0, total_paginas, colunas)
 
         if not registros:
             print("Nenhum registro encontrado via PyMuPDF.")
             return None
 
-        df = pd.DataFrame(registros)
+        df = pd.DataFrame(registros, columns=COLUNAS_NOMES)
         print(f"✅ PyMuPDF produziu {len(df)} registros.")
         return df
 
@@ -206,10 +433,38 @@ def extrair_tabelas(pdf_path):
     return df
 
 
+# ----------------------------------------------------------------------
+# FUNÇÃO: EXPORTAÇÃO PARA EXCEL
+# ----------------------------------------------------------------------
+def _linha_excel(row):
+    """Converte células vazias (NaN/None) em None, como faz o to_excel."""
+    return [None if v is None or (isinstance(v, float) and v != v) else v for v in row]
+
+
+def salvar_excel(df, caminho):
+    """Grava o DataFrame em .xlsx usando o modo write-only do openpyxl (sem estilos)."""
+    if not OPENPYXL_AVAILABLE:
+        df.to_excel(caminho, index=False)
+        return
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    ws.append(list(df.columns))
+    # Linhas são enviadas direto ao arquivo, sem cópia intermediária do DataFrame
+    for row in df.itertuples(index=False, name=None):
+        ws.append(_linha_excel(row))
+    wb.save(caminho)
+
+
 # ----------------------------------------------------------------------
 # EXECUÇÃO DO SCRIPT
 # ----------------------------------------------------------------------
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extrai registros de ponto de um PDF.")
+    parser.add_argument("--excel", action="store_true",
+                        help=f"também gera a planilha {NOME_ARQUIVO_EXCEL} (mais lento que CSV)")
+    args = parser.parse_args()
+
     df_result = extrair_tabelas(NOME_ARQUIVO_PDF)
 
     if df_result is None or df_result.empty:
@@ -220,7 +475,14 @@ if __name__ == "__main__":
         print(f"✅ Total de registros extraídos: {len(df_result)}")
 
         try:
-            df_result.to_excel(NOME_ARQUIVO_EXCEL, index=False)
-            print(f"📁 Planilha salva com sucesso: {NOME_ARQUIVO_EXCEL}")
+            df_result.to_csv(NOME_ARQUIVO_CSV, index=False, encoding="utf-8")
+            print(f"📁 CSV salvo com sucesso: {NOME_ARQUIVO_CSV}")
         except Exception as e:
-            print(f"❌ Erro ao salvar Excel: {e}")
+            print(f"❌ Erro ao salvar CSV: {e}")
+
+        if args.excel:
+            try:
+                salvar_excel(df_result, NOME_ARQUIVO_EXCEL)
+                print(f"📁 Planilha salva com sucesso: {NOME_ARQUIVO_EXCEL}")
+            except Exception as e:
+                print(f"❌ Erro ao salvar Excel: {e}")